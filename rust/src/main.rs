@@ -1,6 +1,7 @@
 use serde::{Deserialize, Serialize};
+use std::collections::{BTreeMap, BTreeSet};
 use std::fs;
-use std::path::Path;
+use std::path::{Path, PathBuf};
 use std::process::Command;
 use tempfile::TempDir;
 
@@ -122,36 +123,106 @@ struct ExperimentResult {
     resolved_version: Option<String>,
     oldest_compatible: Option<String>,
     latest_compatible: Option<String>,
+    /// Oldest toolchain the search tried. Snapshot runs start above 1.0.0,
+    /// so an `oldest_compatible` equal to this may work on older toolchains too.
+    searched_from: Option<String>,
     error: Option<String>,
 }
 
+/// Metadata written next to a local registry snapshot.
+#[derive(Debug, Serialize, Deserialize)]
+struct RegistrySnapshot {
+    /// UTC date (YYYY-MM-DD) the crates were fetched from crates.io.
+    date: String,
+    /// The (name, version spec) pairs the snapshot was built for.
+    crates: Vec<(String, String)>,
+}
+
 fn main() {
-    let args: Vec<String> = std::env::args().collect();
+    let mut args: Vec<String> = std::env::args().skip(1).collect();
 
-    // Check if a specific crate was requested.
-    let specific_crate = if args.len() > 1 {
-        Some(args[1].as_str())
-    } else {
-        None
+    // Take all flags out first so that only positional arguments remain.
+    // Resolve dependencies against a local registry snapshot instead of crates.io.
+    let registry_dir = take_flag_value(&mut args, "--registry");
+    // Cap the disk used by toolchains the experiment installs, in GiB.
+    let budget = take_flag_value(&mut args, "--disk-budget").map(|gib| {
+        match gib.parse::<f64>() {
+            Ok(gib) if gib >= 0.0 => (gib * 1024.0 * 1024.0 * 1024.0) as u64,
+            _ => {
+                eprintln!("Invalid disk budget '{}', expected GiB", gib);
+                std::process::exit(1);
+            }
+        }
+    });
+
+    if args.first().map(String::as_str) == Some("snapshot") {
+        let snapshot_dir = args.get(1).map(String::as_str).unwrap_or("registry-snapshot");
+        println!("Creating registry snapshot in {}", snapshot_dir);
+        if let Err(e) = create_registry_snapshot(Path::new(snapshot_dir)) {
+            eprintln!("Failed to create registry snapshot: {}", e);
+            std::process::exit(1);
+        }
+        return;
+    }
+
+    let registry = match registry_dir {
+        Some(dir) => match load_registry_snapshot(Path::new(&dir)) {
+            Ok(registry) => Some(registry),
+            Err(e) => {
+                eprintln!("Failed to load registry snapshot {}: {}", dir, e);
+                std::process::exit(1);
+            }
+        },
+        None => None,
     };
+    let registry = registry.as_deref();
+    let rustup = Rustup::new();
+    let state_path = rustup.home.join(TOOLCHAIN_STATE_FILE);
+    let mut store = ToolchainStore::open(Box::new(rustup), budget, &state_path);
+
+    // Check if a specific crate was requested.
+    let specific_crate = args.first().map(String::as_str);
+
+    if let (Some(crate_name), Some(_)) = (specific_crate, registry) {
+        if !CRATES.iter().any(|(name, _)| *name == crate_name) {
+            eprintln!(
+                "'{}' is not in CRATES, so the registry snapshot does not contain it; \
+                 run without --registry or add it to CRATES and create a new snapshot",
+                crate_name
+            );
+            std::process::exit(1);
+        }
+    }
 
     if let Some(crate_name) = specific_crate {
         println!("Testing single crate: {}", crate_name);
-        run_single_crate_experiment(crate_name);
+        run_single_crate_experiment(crate_name, registry, &mut store);
     } else {
         println!("Starting dependency toolchain compatibility experiment");
         println!("Testing {} crates", CRATES.len());
-        run_full_experiment();
+        run_full_experiment(registry, &mut store);
+    }
+}
+
+/// Remove `flag` and the value following it from `args`, returning the value.
+fn take_flag_value(args: &mut Vec<String>, flag: &str) -> Option<String> {
+    let index = args.iter().position(|arg| arg == flag)?;
+    if index + 1 >= args.len() {
+        eprintln!("Missing value for {}", flag);
+        std::process::exit(1);
     }
+    let value = args.remove(index + 1);
+    args.remove(index);
+    Some(value)
 }
 
 /// Run the full experiment on all crates.
-fn run_full_experiment() {
+fn run_full_experiment(registry: Option<&Path>, store: &mut ToolchainStore) {
     let mut results = Vec::new();
 
     // First, test the control case (no dependencies).
     println!("\n=== Testing control case (no dependencies) ===");
-    match test_control_case() {
+    match test_control_case(registry.is_some(), store) {
         Ok(result) => {
             println!("Control: oldest={:?}, latest={:?}",
                 result.oldest_compatible, result.latest_compatible);
@@ -165,7 +236,7 @@ fn run_full_experiment() {
     // Test each crate.
     for (crate_name, version) in CRATES {
         println!("\n=== Testing {} ===", crate_name);
-        match test_crate(crate_name, version) {
+        match test_crate(crate_name, version, registry, store) {
             Ok(result) => {
                 println!("{}: oldest={:?}, latest={:?}",
                     crate_name, result.oldest_compatible, result.latest_compatible);
@@ -179,6 +250,7 @@ fn run_full_experiment() {
                     resolved_version: None,
                     oldest_compatible: None,
                     latest_compatible: None,
+                    searched_from: None,
                     error: Some(e.to_string()),
                 });
             }
@@ -192,7 +264,11 @@ fn run_full_experiment() {
 }
 
 /// Run experiment on a single crate.
-fn run_single_crate_experiment(crate_name: &str) {
+fn run_single_crate_experiment(
+    crate_name: &str,
+    registry: Option<&Path>,
+    store: &mut ToolchainStore,
+) {
     // Find the crate in our list.
     let crate_entry = CRATES.iter().find(|(name, _)| *name == crate_name);
 
@@ -206,13 +282,14 @@ fn run_single_crate_experiment(crate_name: &str) {
 
     println!("\n=== Testing {} (version spec: {}) ===", crate_name, version_spec);
 
-    match test_crate(crate_name, version_spec) {
+    match test_crate(crate_name, version_spec, registry, store) {
         Ok(result) => {
             println!("\nResults for {}:", crate_name);
             println!("  Dependency spec: {}", result.dependency_spec);
             println!("  Resolved version: {}", result.resolved_version.as_ref().unwrap_or(&"N/A".to_string()));
             println!("  Oldest compatible: {}", result.oldest_compatible.as_ref().unwrap_or(&"N/A".to_string()));
             println!("  Latest compatible: {}", result.latest_compatible.as_ref().unwrap_or(&"N/A".to_string()));
+            println!("  Searched from: {}", result.searched_from.as_ref().unwrap_or(&"N/A".to_string()));
 
             // Write single result to a file.
             let json = serde_json::to_string_pretty(&result).unwrap();
@@ -233,7 +310,12 @@ fn run_single_crate_experiment(crate_name: &str) {
 }
 
 /// Test the control case with no dependencies.
-fn test_control_case() -> Result<ExperimentResult, Box<dyn std::error::Error>> {
+///
+/// In snapshot mode the control searches the same toolchains as the crates.
+fn test_control_case(
+    snapshot: bool,
+    store: &mut ToolchainStore,
+) -> Result<ExperimentResult, Box<dyn std::error::Error>> {
     let temp_dir = TempDir::new()?;
     let project_path = temp_dir.path();
 
@@ -251,7 +333,7 @@ edition = "2015"
     fs::create_dir(project_path.join("src"))?;
     fs::write(project_path.join("src/lib.rs"), "// Control case with no dependencies\n")?;
 
-    let oldest = find_oldest_compatible(project_path)?;
+    let oldest = find_oldest_compatible(project_path, snapshot, store)?;
     let latest = RUST_VERSIONS.last().map(|s| s.to_string());
 
     Ok(ExperimentResult {
@@ -260,15 +342,49 @@ edition = "2015"
         resolved_version: None,
         oldest_compatible: oldest,
         latest_compatible: latest,
+        searched_from: Some(search_floor(snapshot).to_string()),
         error: None,
     })
 }
 
 /// Test a single crate.
-fn test_crate(crate_name: &str, version_spec: &str) -> Result<ExperimentResult, Box<dyn std::error::Error>> {
+fn test_crate(
+    crate_name: &str,
+    version_spec: &str,
+    registry: Option<&Path>,
+    store: &mut ToolchainStore,
+) -> Result<ExperimentResult, Box<dyn std::error::Error>> {
     let temp_dir = TempDir::new()?;
     let project_path = temp_dir.path();
 
+    write_crate_project(project_path, crate_name, version_spec)?;
+    if let Some(registry) = registry {
+        write_registry_config(project_path, registry)?;
+    }
+
+    // Get resolved version with latest stable.
+    let resolved_version = get_resolved_version(project_path, crate_name)?;
+
+    let oldest = find_oldest_compatible(project_path, registry.is_some(), store)?;
+    let latest = RUST_VERSIONS.last().map(|s| s.to_string());
+
+    Ok(ExperimentResult {
+        crate_name: crate_name.to_string(),
+        dependency_spec: version_spec.to_string(),
+        resolved_version: Some(resolved_version),
+        oldest_compatible: oldest,
+        latest_compatible: latest,
+        searched_from: Some(search_floor(registry.is_some()).to_string()),
+        error: None,
+    })
+}
+
+/// Write a project depending on a single crate.
+fn write_crate_project(
+    project_path: &Path,
+    crate_name: &str,
+    version_spec: &str,
+) -> Result<(), Box<dyn std::error::Error>> {
     // Create Cargo.toml.
     let cargo_toml = format!(
         r#"[package]
@@ -288,20 +404,221 @@ edition = "2015"
     let lib_rs = generate_lib_rs(crate_name);
     fs::write(project_path.join("src/lib.rs"), lib_rs)?;
 
-    // Get resolved version with latest stable.
-    let resolved_version = get_resolved_version(project_path, crate_name)?;
+    Ok(())
+}
 
-    let oldest = find_oldest_compatible(project_path)?;
-    let latest = RUST_VERSIONS.last().map(|s| s.to_string());
+/// Where snapshots fetch index entries and crate files from.
+const CRATES_IO_INDEX: &str = "https://index.crates.io";
+const CRATES_IO_DOWNLOAD: &str = "https://static.crates.io/crates";
 
-    Ok(ExperimentResult {
-        crate_name: crate_name.to_string(),
-        dependency_spec: version_spec.to_string(),
-        resolved_version: Some(resolved_version),
-        oldest_compatible: oldest,
-        latest_compatible: latest,
-        error: None,
-    })
+/// The oldest Rust whose cargo supports source replacement.
+///
+/// Older toolchains ignore the snapshot and would resolve against the
+/// live index, so in snapshot mode they are not probed.
+const SNAPSHOT_MIN_RUST: &str = "1.12.0";
+
+/// Create a local registry snapshot of every crate in `CRATES`
+/// and their transitive dependencies.
+///
+/// Each crate gets its own project, resolved independently just as the
+/// experiment does. Every package in those lockfiles is then copied into
+/// a cargo local registry under `registry/`: the crates.io index entry
+/// for that exact version plus its `.crate` file. Unlike a directory
+/// source, cargo only unpacks the packages a project actually resolves,
+/// so a manifest that an old cargo can't parse only affects the crates
+/// that depend on it. The fetch date is recorded in `snapshot.json` so
+/// results can be tied back to the state of crates.io.
+fn create_registry_snapshot(snapshot_dir: &Path) -> Result<(), Box<dyn std::error::Error>> {
+    let temp_dir = TempDir::new()?;
+    let mut packages = BTreeSet::new();
+
+    for (crate_name, version_spec) in CRATES {
+        println!("  Resolving {}", crate_name);
+        let project_path = temp_dir.path().join(crate_name);
+        fs::create_dir(&project_path)?;
+        write_crate_project(&project_path, crate_name, version_spec)?;
+
+        let output = Command::new("cargo")
+            .arg("generate-lockfile")
+            .current_dir(&project_path)
+            .output()?;
+        if !output.status.success() {
+            return Err(format!("Failed to resolve {}", crate_name).into());
+        }
+
+        packages.extend(locked_registry_packages(&project_path.join("Cargo.lock"))?);
+    }
+
+    let registry_dir = snapshot_dir.join("registry");
+    fs::create_dir_all(registry_dir.join("index"))?;
+
+    // Group by name so each index file is fetched once.
+    let mut versions_by_name: BTreeMap<&str, BTreeSet<&str>> = BTreeMap::new();
+    for (name, version) in &packages {
+        versions_by_name.entry(name).or_default().insert(version);
+    }
+
+    for (name, versions) in &versions_by_name {
+        println!("  Fetching {} ({} versions)", name, versions.len());
+        let index_file = index_path(name);
+        let entries = String::from_utf8(curl(&format!("{}/{}", CRATES_IO_INDEX, index_file))?)?;
+
+        let mut snapshot_entries = String::new();
+        for line in entries.lines() {
+            let entry: serde_json::Value = serde_json::from_str(line)?;
+            if entry["vers"].as_str().is_some_and(|vers| versions.contains(vers)) {
+                snapshot_entries.push_str(line);
+                snapshot_entries.push('\n');
+            }
+        }
+
+        let index_file = registry_dir.join("index").join(index_file);
+        fs::create_dir_all(index_file.parent().unwrap())?;
+        fs::write(index_file, snapshot_entries)?;
+
+        for version in versions {
+            let url = format!("{}/{}/{}-{}.crate", CRATES_IO_DOWNLOAD, name, name, version);
+            let crate_file = registry_dir.join(format!("{}-{}.crate", name, version));
+            fs::write(crate_file, curl(&url)?)?;
+        }
+    }
+
+    let snapshot = RegistrySnapshot {
+        date: today_utc(),
+        crates: CRATES
+            .iter()
+            .map(|(name, version)| (name.to_string(), version.to_string()))
+            .collect(),
+    };
+    let json = serde_json::to_string_pretty(&snapshot)?;
+    fs::write(snapshot_dir.join("snapshot.json"), json)?;
+    println!(
+        "Registry snapshot of {} packages from {} written to {}",
+        packages.len(),
+        snapshot.date,
+        snapshot_dir.display()
+    );
+
+    Ok(())
+}
+
+/// The (name, version) of every crates.io package in a Cargo.lock.
+fn locked_registry_packages(
+    lock_path: &Path,
+) -> Result<Vec<(String, String)>, Box<dyn std::error::Error>> {
+    let lock_content = fs::read_to_string(lock_path)?;
+    let mut packages = Vec::new();
+    let mut name = None;
+    let mut version = None;
+
+    // A trailing "[[package]]" flushes the last entry.
+    for line in lock_content.lines().chain(std::iter::once("[[package]]")) {
+        if line.starts_with("[[package]]") {
+            name = None;
+            version = None;
+        } else if let Some(value) = line.strip_prefix("name = ") {
+            name = Some(value.trim_matches('"').to_string());
+        } else if let Some(value) = line.strip_prefix("version = ") {
+            version = Some(value.trim_matches('"').to_string());
+        } else if line.starts_with("source = \"registry+") {
+            if let (Some(name), Some(version)) = (name.take(), version.take()) {
+                packages.push((name, version));
+            }
+        }
+    }
+
+    Ok(packages)
+}
+
+/// Path of a crate's file within a cargo registry index.
+fn index_path(name: &str) -> String {
+    let name = name.to_lowercase();
+    match name.len() {
+        1 => format!("1/{}", name),
+        2 => format!("2/{}", name),
+        3 => format!("3/{}/{}", &name[..1], name),
+        _ => format!("{}/{}/{}", &name[..2], &name[2..4], name),
+    }
+}
+
+/// Download a URL with curl.
+fn curl(url: &str) -> Result<Vec<u8>, Box<dyn std::error::Error>> {
+    let output = Command::new("curl").args(["-sSfL", url]).output()?;
+    if !output.status.success() {
+        return Err(format!(
+            "Failed to download {}: {}",
+            url,
+            String::from_utf8_lossy(&output.stderr).trim()
+        )
+        .into());
+    }
+    Ok(output.stdout)
+}
+
+/// Check a registry snapshot and return the absolute path of its local registry.
+fn load_registry_snapshot(snapshot_dir: &Path) -> Result<PathBuf, Box<dyn std::error::Error>> {
+    let json = fs::read_to_string(snapshot_dir.join("snapshot.json"))?;
+    let snapshot: RegistrySnapshot = serde_json::from_str(&json)?;
+
+    let missing: Vec<&str> = CRATES
+        .iter()
+        .filter(|(name, version)| {
+            !snapshot.crates.iter().any(|(n, v)| n == name && v == version)
+        })
+        .map(|(name, _)| *name)
+        .collect();
+    if !missing.is_empty() {
+        return Err(format!("snapshot does not contain {}", missing.join(", ")).into());
+    }
+
+    println!("Using registry snapshot from {}", snapshot.date);
+    Ok(fs::canonicalize(snapshot_dir.join("registry"))?)
+}
+
+/// Point a project's crates.io dependencies at a local registry snapshot.
+///
+/// Uses `.cargo/config` rather than `config.toml` so that older cargo
+/// versions pick it up too. Source replacement arrived in Rust 1.12
+/// (`SNAPSHOT_MIN_RUST`); toolchains before that ignore it.
+fn write_registry_config(project_path: &Path, registry: &Path) -> Result<(), Box<dyn std::error::Error>> {
+    let config = format!(
+        r#"[source.crates-io]
+replace-with = "snapshot"
+
+[source.snapshot]
+local-registry = "{}"
+"#,
+        registry.display().to_string().replace('\\', "/")
+    );
+    fs::create_dir_all(project_path.join(".cargo"))?;
+    fs::write(project_path.join(".cargo/config"), config)?;
+
+    Ok(())
+}
+
+/// Today's date in UTC as YYYY-MM-DD.
+fn today_utc() -> String {
+    let secs = std::time::SystemTime::now()
+        .duration_since(std::time::UNIX_EPOCH)
+        .map(|d| d.as_secs())
+        .unwrap_or(0);
+    date_from_unix(secs)
+}
+
+/// The UTC date of a Unix timestamp as YYYY-MM-DD.
+fn date_from_unix(secs: u64) -> String {
+    // Civil date from days since 1970-01-01 (Howard Hinnant's algorithm).
+    let days = (secs / 86_400) as i64 + 719_468;
+    let era = days.div_euclid(146_097);
+    let doe = days.rem_euclid(146_097);
+    let yoe = (doe - doe / 1_460 + doe / 36_524 - doe / 146_096) / 365;
+    let doy = doe - (365 * yoe + yoe / 4 - yoe / 100);
+    let mp = (5 * doy + 2) / 153;
+    let day = doy - (153 * mp + 2) / 5 + 1;
+    let month = if mp < 10 { mp + 3 } else { mp - 9 };
+    let year = yoe + era * 400 + if month <= 2 { 1 } else { 0 };
+
+    format!("{:04}-{:02}-{:02}", year, month, day)
 }
 
 /// Generate lib.rs content that uses the crate.
@@ -373,10 +690,19 @@ const RUST_VERSIONS: &[&str] = &[
 ];
 
 /// Find the oldest compatible Rust version using binary search.
+///
+/// Projects using a registry snapshot only search toolchains from
+/// `SNAPSHOT_MIN_RUST` on, since older ones would go to the network.
 fn find_oldest_compatible(
     project_path: &Path,
+    snapshot: bool,
+    store: &mut ToolchainStore,
 ) -> Result<Option<String>, Box<dyn std::error::Error>> {
-    let mut left = 0;
+    let floor = search_floor(snapshot);
+    let mut left = RUST_VERSIONS.iter().position(|version| *version == floor).unwrap_or(0);
+    if left > 0 {
+        println!("  Skipping toolchains before Rust {} (no source replacement)", floor);
+    }
     let mut right = RUST_VERSIONS.len();
     let mut oldest = None;
 
@@ -386,7 +712,7 @@ fn find_oldest_compatible(
 
         println!("  Testing Rust {}", version);
 
-        if test_rust_version(project_path, version)? {
+        if test_rust_version(project_path, version, store)? {
             oldest = Some(version.to_string());
             right = mid;
         } else {
@@ -397,6 +723,19 @@ fn find_oldest_compatible(
     Ok(oldest)
 }
 
+/// The oldest toolchain `find_oldest_compatible` searches.
+fn search_floor(snapshot: bool) -> &'static str {
+    if snapshot {
+        RUST_VERSIONS
+            .iter()
+            .find(|version| !version_less_than(version, SNAPSHOT_MIN_RUST))
+            .copied()
+            .unwrap_or(RUST_VERSIONS[0])
+    } else {
+        RUST_VERSIONS[0]
+    }
+}
+
 /// Compare two version strings (e.g., "1.15.1" < "1.16.0").
 fn version_less_than(a: &str, b: &str) -> bool {
     let parse = |v: &str| -> (u32, u32, u32) {
@@ -411,13 +750,13 @@ fn version_less_than(a: &str, b: &str) -> bool {
 }
 
 /// Test if a project compiles with a specific Rust version.
-fn test_rust_version(project_path: &Path, version: &str) -> Result<bool, Box<dyn std::error::Error>> {
+fn test_rust_version(
+    project_path: &Path,
+    version: &str,
+    store: &mut ToolchainStore,
+) -> Result<bool, Box<dyn std::error::Error>> {
     // First, ensure the toolchain is installed.
-    let install_output = Command::new("rustup")
-        .args(&["toolchain", "install", version])
-        .output()?;
-
-    if !install_output.status.success() {
+    if !store.ensure_installed(version)? {
         println!("    Failed to install {}", version);
         return Ok(false);
     }
@@ -443,3 +782,527 @@ fn test_rust_version(project_path: &Path, version: &str) -> Result<bool, Box<dyn
 
     Ok(check_output.status.success())
 }
+
+/// The file in `RUSTUP_HOME` where the toolchain store keeps its state.
+///
+/// It lives next to the toolchains rather than in the checkout, so
+/// which toolchains the store installed survives clean checkouts and
+/// runs from other directories.
+const TOOLCHAIN_STATE_FILE: &str = "toolchain-horizons.json";
+
+/// Installs, removes and measures toolchains on behalf of a `ToolchainStore`.
+///
+/// The experiment uses `Rustup`; a stub backend can stand in for it
+/// to exercise the store without downloading real toolchains.
+trait ToolchainBackend {
+    /// Install a toolchain, returning whether installation succeeded.
+    fn install(&self, version: &str) -> Result<bool, Box<dyn std::error::Error>>;
+
+    /// Remove an installed toolchain.
+    fn uninstall(&self, version: &str) -> Result<(), Box<dyn std::error::Error>>;
+
+    /// Bytes used by a toolchain on disk, or `None` if it is not installed.
+    fn installed_size(&self, version: &str) -> Result<Option<u64>, Box<dyn std::error::Error>>;
+}
+
+/// Toolchains managed through `rustup`.
+struct Rustup {
+    home: PathBuf,
+    toolchains_dir: PathBuf,
+}
+
+impl Rustup {
+    fn new() -> Rustup {
+        let rustup_home = std::env::var_os("RUSTUP_HOME")
+            .map(PathBuf::from)
+            .or_else(|| std::env::var_os("HOME").map(|home| Path::new(&home).join(".rustup")))
+            .unwrap_or_else(|| PathBuf::from(".rustup"));
+        Rustup {
+            toolchains_dir: rustup_home.join("toolchains"),
+            home: rustup_home,
+        }
+    }
+}
+
+impl ToolchainBackend for Rustup {
+    fn install(&self, version: &str) -> Result<bool, Box<dyn std::error::Error>> {
+        // The minimal profile skips docs, rustfmt and clippy, which probes don't use.
+        let output = Command::new("rustup")
+            .args(["toolchain", "install", "--profile", "minimal", version])
+            .output()?;
+        if output.status.success() {
+            return Ok(true);
+        }
+
+        // Rustup before 1.20 has no profiles.
+        if String::from_utf8_lossy(&output.stderr).contains("--profile") {
+            let output = Command::new("rustup")
+                .args(["toolchain", "install", version])
+                .output()?;
+            return Ok(output.status.success());
+        }
+
+        Ok(false)
+    }
+
+    fn uninstall(&self, version: &str) -> Result<(), Box<dyn std::error::Error>> {
+        let output = Command::new("rustup")
+            .args(["toolchain", "uninstall", version])
+            .output()?;
+        if !output.status.success() {
+            return Err(format!("Failed to uninstall {}", version).into());
+        }
+        Ok(())
+    }
+
+    fn installed_size(&self, version: &str) -> Result<Option<u64>, Box<dyn std::error::Error>> {
+        if !self.toolchains_dir.exists() {
+            return Ok(None);
+        }
+
+        // Toolchain directories are named after the version and host triple,
+        // e.g. "1.50.0-x86_64-unknown-linux-gnu".
+        let prefix = format!("{}-", version);
+        for entry in fs::read_dir(&self.toolchains_dir)? {
+            let entry = entry?;
+            let name = entry.file_name().to_string_lossy().to_string();
+            if name == version || name.starts_with(&prefix) {
+                return Ok(Some(dir_size(&entry.path())?));
+            }
+        }
+
+        Ok(None)
+    }
+}
+
+/// Total size of the files under a directory, not following symlinks.
+fn dir_size(path: &Path) -> Result<u64, Box<dyn std::error::Error>> {
+    let mut size = 0;
+    for entry in fs::read_dir(path)? {
+        let path = entry?.path();
+        let metadata = fs::symlink_metadata(&path)?;
+        if metadata.is_dir() {
+            size += dir_size(&path)?;
+        } else {
+            size += metadata.len();
+        }
+    }
+    Ok(size)
+}
+
+/// Usage statistics for one toolchain.
+#[derive(Debug, Default, Serialize, Deserialize)]
+struct ToolchainUsage {
+    /// How many times the toolchain has been probed.
+    probes: u64,
+    /// Store clock value at the most recent probe.
+    last_probe: u64,
+    /// Bytes on disk when last installed.
+    size: u64,
+    /// Whether the toolchain is currently installed.
+    installed: bool,
+    /// Whether the store installed this toolchain and may evict it.
+    /// Toolchains that were already installed are left alone.
+    managed: bool,
+}
+
+/// Persistent state of a `ToolchainStore`.
+#[derive(Debug, Default, Serialize, Deserialize)]
+struct ToolchainState {
+    /// Logical clock, advanced once per probe.
+    clock: u64,
+    toolchains: BTreeMap<String, ToolchainUsage>,
+}
+
+/// Keeps the toolchains installed by the experiment within a disk budget.
+///
+/// Every probe is counted. When the toolchains the store installed would
+/// exceed the budget, the least frequently probed ones are uninstalled
+/// first, with the least recently probed going first among equals. The
+/// binary search always starts from the same midpoints, so those
+/// toolchains accumulate probes and stay resident while the rarely
+/// visited ends of the range are evicted. Evicted toolchains are
+/// reinstalled on demand.
+///
+/// Without a budget the store just installs toolchains and keeps no state.
+/// With one, it assumes it is the only budgeted store using its
+/// `RUSTUP_HOME` at a time: concurrent runs can't corrupt the state file,
+/// but each may evict a toolchain the other is probing.
+struct ToolchainStore {
+    backend: Box<dyn ToolchainBackend>,
+    /// Disk budget in bytes, or `None` for no limit.
+    budget: Option<u64>,
+    state_path: PathBuf,
+    state: ToolchainState,
+}
+
+impl ToolchainStore {
+    /// Open a store, loading its state from `state_path` if there is a budget.
+    ///
+    /// State that can't be read starts the store afresh rather than
+    /// failing the run.
+    fn open(
+        backend: Box<dyn ToolchainBackend>,
+        budget: Option<u64>,
+        state_path: &Path,
+    ) -> ToolchainStore {
+        let state = if budget.is_some() && state_path.exists() {
+            let state = fs::read_to_string(state_path)
+                .map_err(|e| e.to_string())
+                .and_then(|json| serde_json::from_str(&json).map_err(|e| e.to_string()));
+            state.unwrap_or_else(|e| {
+                eprintln!("Ignoring unreadable toolchain state {}: {}", state_path.display(), e);
+                ToolchainState::default()
+            })
+        } else {
+            ToolchainState::default()
+        };
+
+        ToolchainStore {
+            backend,
+            budget,
+            state_path: state_path.to_path_buf(),
+            state,
+        }
+    }
+
+    /// Make sure a toolchain is installed and record a probe of it.
+    ///
+    /// Returns whether the toolchain is available. Before installing,
+    /// other toolchains are evicted to make room for it, using its last
+    /// known size or else the largest known toolchain as the estimate.
+    fn ensure_installed(&mut self, version: &str) -> Result<bool, Box<dyn std::error::Error>> {
+        if self.budget.is_none() {
+            return self.backend.install(version);
+        }
+
+        self.state.clock += 1;
+        let clock = self.state.clock;
+
+        let existing_size = self.backend.installed_size(version)?;
+        let usage = self
+            .state
+            .toolchains
+            .entry(version.to_string())
+            .or_insert_with(|| ToolchainUsage {
+                managed: existing_size.is_none(),
+                ..ToolchainUsage::default()
+            });
+        usage.probes += 1;
+        usage.last_probe = clock;
+
+        let size = match existing_size {
+            Some(size) => size,
+            None => {
+                let estimate = match usage.size {
+                    0 => self.largest_known_size(),
+                    size => size,
+                };
+                self.evict(version, estimate)?;
+
+                if !self.backend.install(version)? {
+                    self.save()?;
+                    return Ok(false);
+                }
+                self.backend.installed_size(version)?.unwrap_or(0)
+            }
+        };
+        if let Some(usage) = self.state.toolchains.get_mut(version) {
+            usage.size = size;
+            usage.installed = true;
+        }
+
+        // The estimate may have been low.
+        self.evict(version, 0)?;
+        self.save()?;
+
+        Ok(true)
+    }
+
+    /// Bytes currently used by toolchains the store installed.
+    fn used(&self) -> u64 {
+        self.state
+            .toolchains
+            .values()
+            .filter(|usage| usage.managed && usage.installed)
+            .map(|usage| usage.size)
+            .sum()
+    }
+
+    /// Size of the largest toolchain seen so far, or 0 if none.
+    fn largest_known_size(&self) -> u64 {
+        self.state
+            .toolchains
+            .values()
+            .map(|usage| usage.size)
+            .max()
+            .unwrap_or(0)
+    }
+
+    /// Uninstall managed toolchains until they plus `reserve` bytes fit
+    /// in the budget, never evicting the toolchain that is about to be used.
+    fn evict(&mut self, in_use: &str, reserve: u64) -> Result<(), Box<dyn std::error::Error>> {
+        let budget = match self.budget {
+            Some(budget) => budget,
+            None => return Ok(()),
+        };
+
+        let mut used = self.used();
+
+        while used + reserve > budget {
+            let victim = self
+                .state
+                .toolchains
+                .iter()
+                .filter(|(version, usage)| {
+                    usage.managed && usage.installed && version.as_str() != in_use
+                })
+                .min_by_key(|(_, usage)| (usage.probes, usage.last_probe))
+                .map(|(version, _)| version.clone());
+
+            let victim = match victim {
+                Some(victim) => victim,
+                None => break,
+            };
+
+            println!("    Evicting Rust {} to stay within disk budget", victim);
+            self.backend.uninstall(&victim)?;
+            if let Some(usage) = self.state.toolchains.get_mut(&victim) {
+                used -= usage.size;
+                usage.installed = false;
+            }
+        }
+
+        Ok(())
+    }
+
+    /// Write the store's state so later runs keep the same hot set.
+    ///
+    /// The state goes to a temporary file that is renamed into place, so an
+    /// interrupted write never leaves a truncated state file behind.
+    fn save(&self) -> Result<(), Box<dyn std::error::Error>> {
+        let json = serde_json::to_string_pretty(&self.state)?;
+        let mut temp_path = self.state_path.clone().into_os_string();
+        temp_path.push(format!(".{}.tmp", std::process::id()));
+        fs::write(&temp_path, json)?;
+        fs::rename(&temp_path, &self.state_path)?;
+        Ok(())
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use std::cell::RefCell;
+    use std::rc::Rc;
+
+    /// Size of every stub toolchain the store installs.
+    const SIZE: u64 = 10;
+
+    /// In-memory toolchains shared between a test and its store.
+    #[derive(Default)]
+    struct Disk {
+        installed: BTreeMap<String, u64>,
+        installs: Vec<String>,
+        peak: u64,
+    }
+
+    struct StubBackend(Rc<RefCell<Disk>>);
+
+    impl ToolchainBackend for StubBackend {
+        fn install(&self, version: &str) -> Result<bool, Box<dyn std::error::Error>> {
+            let mut disk = self.0.borrow_mut();
+            disk.installed.insert(version.to_string(), SIZE);
+            disk.installs.push(version.to_string());
+            disk.peak = disk.peak.max(disk.installed.values().sum());
+            Ok(true)
+        }
+
+        fn uninstall(&self, version: &str) -> Result<(), Box<dyn std::error::Error>> {
+            self.0.borrow_mut().installed.remove(version);
+            Ok(())
+        }
+
+        fn installed_size(&self, version: &str) -> Result<Option<u64>, Box<dyn std::error::Error>> {
+            Ok(self.0.borrow().installed.get(version).copied())
+        }
+    }
+
+    fn store(budget: u64, preinstalled: &[(&str, u64)]) -> (ToolchainStore, Rc<RefCell<Disk>>, TempDir) {
+        let disk = Rc::new(RefCell::new(Disk::default()));
+        for (version, size) in preinstalled {
+            disk.borrow_mut().installed.insert(version.to_string(), *size);
+        }
+        let state_dir = TempDir::new().unwrap();
+        let store = ToolchainStore::open(
+            Box::new(StubBackend(disk.clone())),
+            Some(budget),
+            &state_dir.path().join(TOOLCHAIN_STATE_FILE),
+        );
+        (store, disk, state_dir)
+    }
+
+    fn probe(store: &mut ToolchainStore, versions: &[&str]) {
+        for version in versions {
+            assert!(store.ensure_installed(version).unwrap());
+        }
+    }
+
+    fn installed(disk: &Rc<RefCell<Disk>>) -> Vec<String> {
+        disk.borrow().installed.keys().cloned().collect()
+    }
+
+    #[test]
+    fn locked_registry_packages_skips_path_packages() {
+        let dir = TempDir::new().unwrap();
+        let lock_path = dir.path().join("Cargo.lock");
+        fs::write(
+            &lock_path,
+            r#"# This file is automatically @generated by Cargo.
+version = 3
+
+[[package]]
+name = "cfg-if"
+version = "1.0.0"
+source = "registry+https://github.com/rust-lang/crates.io-index"
+checksum = "baf1de4339761588bc0619e3cbc0120ee582ebb74b53b4efbf79117bd2da40fd"
+
+[[package]]
+name = "test-log"
+version = "0.1.0"
+dependencies = [
+ "log",
+]
+
+[[package]]
+name = "log"
+version = "0.4.22"
+source = "registry+https://github.com/rust-lang/crates.io-index"
+dependencies = [
+ "cfg-if",
+]
+"#,
+        )
+        .unwrap();
+
+        assert_eq!(
+            locked_registry_packages(&lock_path).unwrap(),
+            [
+                ("cfg-if".to_string(), "1.0.0".to_string()),
+                ("log".to_string(), "0.4.22".to_string()),
+            ]
+        );
+    }
+
+    #[test]
+    fn index_path_follows_registry_layout() {
+        assert_eq!(index_path("a"), "1/a");
+        assert_eq!(index_path("cc"), "2/cc");
+        assert_eq!(index_path("syn"), "3/s/syn");
+        assert_eq!(index_path("serde"), "se/rd/serde");
+        assert_eq!(index_path("Inflector"), "in/fl/inflector");
+        assert_eq!(index_path("Fnv"), "3/f/fnv");
+    }
+
+    #[test]
+    fn date_from_unix_handles_known_dates() {
+        assert_eq!(date_from_unix(0), "1970-01-01");
+        assert_eq!(date_from_unix(951_782_400), "2000-02-29");
+        assert_eq!(date_from_unix(1_709_251_199), "2024-02-29");
+        assert_eq!(date_from_unix(1_709_251_200), "2024-03-01");
+        assert_eq!(date_from_unix(1_735_689_599), "2024-12-31");
+        assert_eq!(date_from_unix(4_102_444_800), "2100-01-01");
+    }
+
+    #[test]
+    fn evicts_fewest_probes_then_least_recent() {
+        let (mut store, disk, _state_dir) = store(3 * SIZE, &[]);
+        probe(&mut store, &["a", "a", "b", "c", "b", "c", "d"]);
+
+        // a, b and c have two probes each; a was probed longest ago.
+        assert_eq!(installed(&disk), ["b", "c", "d"]);
+
+        probe(&mut store, &["e"]);
+
+        // d has a single probe.
+        assert_eq!(installed(&disk), ["b", "c", "e"]);
+    }
+
+    #[test]
+    fn stays_within_budget() {
+        let (mut store, disk, _state_dir) = store(3 * SIZE, &[]);
+        probe(&mut store, &["a", "b", "c", "d", "a", "e", "f", "b", "g"]);
+
+        assert!(store.used() <= 3 * SIZE);
+        // Room is made before installing, so the budget is never exceeded.
+        assert!(disk.borrow().peak <= 3 * SIZE);
+    }
+
+    #[test]
+    fn never_evicts_toolchain_in_use() {
+        let (mut store, disk, _state_dir) = store(SIZE / 2, &[]);
+        probe(&mut store, &["a", "a", "b"]);
+
+        assert_eq!(installed(&disk), ["b"]);
+    }
+
+    #[test]
+    fn never_evicts_unmanaged_toolchains() {
+        let (mut store, disk, _state_dir) = store(SIZE, &[("stable", 100)]);
+        probe(&mut store, &["stable", "a", "b"]);
+
+        assert_eq!(installed(&disk), ["b", "stable"]);
+        assert!(!store.state.toolchains["stable"].managed);
+    }
+
+    #[test]
+    fn reinstalls_evicted_toolchain() {
+        let (mut store, disk, _state_dir) = store(SIZE, &[]);
+        probe(&mut store, &["a", "b", "a"]);
+
+        assert_eq!(installed(&disk), ["a"]);
+        assert_eq!(disk.borrow().installs, ["a", "b", "a"]);
+        assert_eq!(store.state.toolchains["a"].probes, 2);
+    }
+
+    #[test]
+    fn remembers_managed_toolchains_across_runs() {
+        let (mut store, disk, state_dir) = store(2 * SIZE, &[]);
+        probe(&mut store, &["a", "b"]);
+
+        let state_path = state_dir.path().join(TOOLCHAIN_STATE_FILE);
+        let mut store =
+            ToolchainStore::open(Box::new(StubBackend(disk.clone())), Some(2 * SIZE), &state_path);
+        probe(&mut store, &["a", "c"]);
+
+        // b was installed by the earlier run, so it can still be evicted.
+        assert_eq!(installed(&disk), ["a", "c"]);
+    }
+
+    #[test]
+    fn starts_afresh_from_unreadable_state() {
+        let (_, disk, state_dir) = store(SIZE, &[]);
+        let state_path = state_dir.path().join(TOOLCHAIN_STATE_FILE);
+        fs::write(&state_path, "{\"clock\": 3, \"toolch").unwrap();
+
+        let mut store = ToolchainStore::open(Box::new(StubBackend(disk.clone())), Some(SIZE), &state_path);
+        probe(&mut store, &["a"]);
+
+        let json = fs::read_to_string(&state_path).unwrap();
+        let state: ToolchainState = serde_json::from_str(&json).unwrap();
+        assert_eq!(state.clock, 1);
+        assert_eq!(state.toolchains["a"].probes, 1);
+    }
+
+    #[test]
+    fn keeps_no_state_without_budget() {
+        let disk = Rc::new(RefCell::new(Disk::default()));
+        let state_dir = TempDir::new().unwrap();
+        let state_path = state_dir.path().join(TOOLCHAIN_STATE_FILE);
+        let mut store = ToolchainStore::open(Box::new(StubBackend(disk.clone())), None, &state_path);
+        probe(&mut store, &["a", "b", "a"]);
+
+        assert_eq!(installed(&disk), ["a", "b"]);
+        assert!(!state_path.exists());
+    }
+}